@@ -1,13 +1,24 @@
 """Events are linked to Trials"""
 
 import datajoint as dj
-import inspect
-import importlib 
-from element_calcium_imaging import scan #TR23: there is probably a better method to import scan - but this works
+import numpy as np
+import sys
+import types
+import importlib
+import functools
+import contextlib
+import copy
+import contextvars
+import warnings
+import pathlib
 
 schema = dj.schema() 
 
-_linking_module = None
+# linking module of the current thread/task (contextvars are per thread and
+# per asyncio task); threads started without one fall back to the module
+# most recently passed to `activate`
+_linking_module = contextvars.ContextVar('linking_module', default=None)
+_default_linking_module = None
 
 
 def activate(schema_name, *, create_schema=True, create_tables=True,
@@ -26,6 +37,8 @@ def activate(schema_name, *, create_schema=True, create_tables=True,
             Upstream tables:
                 + Session: parent table to BehaviorRecording, typically
                            identifying a recording session.
+                + Scan (optional): parent table to BehaviorRecording,
+                           defaults to `element_calcium_imaging.scan.Scan`.
             Functions:
                 + get_experiment_root_data_dir() -> list
                     Retrieve the root data director(y/ies) with behavioral
@@ -36,15 +49,43 @@ def activate(schema_name, *, create_schema=True, create_tables=True,
                     for a given Session
                     :param session_key: a dictionary of one Session `key`
                     :return: a string for full path to the session directory
+            External store:
+                + dj.config['stores']['timestamps_store']: store holding the
+                    CameraTimestamps arrays, e.g.
+                    {'protocol': 'file', 'location': '/data/dj_store'}
+                    (or 'protocol': 's3' with a local 'stage' directory)
     """
     if isinstance(linking_module, str):
-        linking_module = importlib.import_module(linking_module)
-    assert inspect.ismodule(linking_module), "The argument 'dependency' must"\
-                                             + " be a module or module name"
+        linking_module = (sys.modules.get(linking_module)
+                          or importlib.import_module(linking_module))
+    if not isinstance(linking_module, types.ModuleType):
+        raise TypeError("The argument 'linking_module' must be a module"
+                        " or module name")
+
+    global _default_linking_module
+    _default_linking_module = linking_module
+    _linking_module.set(linking_module)
+    _get_experiment_root_data_dir.cache_clear()
+    _get_session_directory.cache_clear()
+    refresh_lookup_cache()
+
+    add_objects = dict(linking_module.__dict__)
+    if 'Scan' not in add_objects:
+        add_objects['Scan'] = _get_scan()
 
     schema.activate(schema_name, create_schema=create_schema,
-                    create_tables=create_tables,
-                    add_objects=linking_module.__dict__)
+                    create_tables=create_tables, add_objects=add_objects)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_scan():
+    """
+    Resolve `scan.Scan` (parent of BehaviorRecording) once per process.
+    element_calcium_imaging is imported here rather than at module level as
+    importing it is expensive and only needed to declare BehaviorRecording.
+    """
+    from element_calcium_imaging import scan
+    return scan.Scan
 
 # -------------- Functions required by the element-trial   ---------------
 
@@ -61,7 +102,8 @@ def get_experiment_root_data_dir() -> list:
         :return: a string for full path to the behavioral root data directory,
          or list of strings for possible root data directories
     """
-    return _linking_module.get_experiment_root_data_dir()
+    # copy, so callers modifying the returned list do not alter the cache
+    return copy.copy(_get_experiment_root_data_dir(_get_linking_module()))
 
 
 def get_session_directory(session_key: dict) -> str:
@@ -72,7 +114,26 @@ def get_session_directory(session_key: dict) -> str:
         :param session_key: a dictionary of one Session `key`
         :return: a string for full path to the session directory
     """
-    return _linking_module.get_session_directory(session_key)
+    return _get_session_directory(_get_linking_module(),
+                                  tuple(sorted(session_key.items())))
+
+
+def _get_linking_module():
+    return _linking_module.get() or _default_linking_module
+
+
+# results are cached per linking module, as user implementations typically
+# search the file system; `activate` clears both caches
+
+
+@functools.lru_cache(maxsize=16)
+def _get_experiment_root_data_dir(linking_module):
+    return linking_module.get_experiment_root_data_dir()
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_session_directory(linking_module, session_items):
+    return linking_module.get_session_directory(dict(session_items))
 
 
 # ----------------------------- Table declarations ----------------------
@@ -91,7 +152,7 @@ class EventType(dj.Lookup):
 class BehaviorRecording(dj.Manual):
     definition = """
     -> Session
-    -> scan.Scan 
+    -> Scan
     ---
     recording_start_time=null : datetime
     recording_duration=null   : float
@@ -130,11 +191,57 @@ class Event(dj.Imported):
     definition = """
     -> BehaviorRecording
     -> EventType
-    event_start_time          : decimal(11,5)  # (second) relative to recording start
+    event_start_time          : double  # (second) relative to recording start
     ---
-    event_end_time=null       : decimal(11,5)  # (second) relative to recording start
+    event_end_time=null       : double  # (second) relative to recording start
+    index(event_start_time)
     """
 
+    @classmethod
+    def batch(cls, chunk_size=10_000):
+        """
+        batch(chunk_size=10_000) -> BatchInserter
+            Buffered inserter for Event, see `BatchInserter`
+        """
+        return BatchInserter(cls, chunk_size=chunk_size)
+
+    def insert(self, rows, **kwargs):
+        """Round event times to `EVENT_TIME_DECIMALS` before inserting"""
+        if hasattr(rows, 'to_records'):  # pandas.DataFrame
+            rows = rows.assign(**{
+                attr: rows[attr].round(EVENT_TIME_DECIMALS)
+                for attr in _EVENT_TIME_ATTRIBUTES if attr in rows.columns})
+        elif isinstance(rows, (list, tuple, types.GeneratorType)):
+            rows = list(rows)
+            attribute_names = (self.heading.names if any(
+                isinstance(row, (list, tuple)) for row in rows) else None)
+            rows = [_round_event_times(row, attribute_names) for row in rows]
+        return super().insert(rows, **kwargs)
+
+    @classmethod
+    def fetch_with_interpolations(cls, key=None, batch=1000):
+        """
+        fetch_with_interpolations(key=None, batch=1000) -> dict
+            Fetch the EventInterpolation rows of all Events matching `key`,
+            querying EventInterpolation once per `batch` events rather than
+            once per event
+            :param key: restriction on Event
+            :param batch: number of Event keys per EventInterpolation query
+            :return: dictionary mapping each Event primary key (tuple, in
+                     `Event.primary_key` order) to a list of its
+                     EventInterpolation rows (as dictionaries)
+        """
+        primary_key = cls.primary_key
+        events = cls & key if key is not None else cls()
+        event_keys = events.fetch('KEY', order_by=primary_key)
+        interpolations = {tuple(k[a] for a in primary_key): []
+                          for k in event_keys}
+        for i in range(0, len(event_keys), batch):
+            chunk = event_keys[i:i + batch]
+            for row in (EventInterpolation & chunk).fetch(as_dict=True):
+                interpolations[tuple(row[a] for a in primary_key)].append(row)
+        return interpolations
+
 
 """
 ----- AlignmentEvent -----
@@ -163,8 +270,43 @@ class AlignmentEvent(dj.Manual):
     end_time_shift: float                            # (s) WRT end_event_type
     """
     # WRT - with respect to
+
+
+@schema
+class AlignmentEventResolved(dj.Computed):
+    """AlignmentEvent with the descriptions of its three event types resolved"""
+    definition = """
+    -> AlignmentEvent
+    ---
+    alignment_event_description='' : varchar(300)
+    start_event_description=''     : varchar(300)
+    end_event_description=''       : varchar(300)
+    """
+
+    def make(self, key):
+        event_types = (AlignmentEvent & key).fetch1(
+            'alignment_event_type', 'start_event_type', 'end_event_type')
+        descriptions = dict(zip(*(EventType & [
+            {'event_type': event_type} for event_type in event_types]).fetch(
+                'event_type', 'event_type_description')))
+        self.insert1({**key,
+                      'alignment_event_description': descriptions[event_types[0]],
+                      'start_event_description': descriptions[event_types[1]],
+                      'end_event_description': descriptions[event_types[2]]})
     
     
+_INTERPOLATION_TYPES = (
+    ('LEADING_ZERO', 'Leading NaN/zero frames replaced with 0'),
+    ('DUPLICATE_SEQ', 'Repeated sequence detected and zeroed'),
+    ('PATTERN_446', '4,4,6 pattern corrected to 4,5,5'),
+    ('BAD_DIFF', 'Invalid diff corrected using predicted increment'),
+    ('INTERPOLATED', 'Zero frame filled via linear interpolation'),
+    ('EXTRAPOLATED_LEADING', 'Leading zero extrapolated backwards'),
+    ('EXTRAPOLATED_TRAILING', 'Trailing zero extrapolated forwards'),
+    ('INTERPOLATED_SYNTHETIC', 'No valid frames - synthetic sequence generated'),
+)
+
+
 @schema
 class InterpolationType(dj.Lookup):
     """Types of interpolation/correction applied to event timestamps"""
@@ -173,16 +315,7 @@ class InterpolationType(dj.Lookup):
     ---
     interpolation_description='' : varchar(256)
     """
-    contents = [
-        ('LEADING_ZERO', 'Leading NaN/zero frames replaced with 0'),
-        ('DUPLICATE_SEQ', 'Repeated sequence detected and zeroed'),
-        ('PATTERN_446', '4,4,6 pattern corrected to 4,5,5'),
-        ('BAD_DIFF', 'Invalid diff corrected using predicted increment'),
-        ('INTERPOLATED', 'Zero frame filled via linear interpolation'),
-        ('EXTRAPOLATED_LEADING', 'Leading zero extrapolated backwards'),
-        ('EXTRAPOLATED_TRAILING', 'Trailing zero extrapolated forwards'),
-        ('INTERPOLATED_SYNTHETIC', 'No valid frames - synthetic sequence generated'),
-    ]
+    contents = _INTERPOLATION_TYPES
 
 @schema
 class BpodRecording(dj.Manual):
@@ -220,6 +353,174 @@ class EventInterpolation(dj.Manual):
     details=''                  : varchar(256)  # additional correction details
     """
 
+    @classmethod
+    def batch(cls, chunk_size=10_000):
+        """
+        batch(chunk_size=10_000) -> BatchInserter
+            Buffered inserter for EventInterpolation, see `BatchInserter`
+        """
+        return BatchInserter(cls, chunk_size=chunk_size)
+
+    @classmethod
+    def bulk_load_df(cls, df, chunk_size=50_000):
+        """
+        bulk_load_df(df, chunk_size=50_000)
+            Insert a pandas DataFrame of EventInterpolation rows as multi-row
+            INSERTs of up to `chunk_size` rows within a single transaction
+            (the caller's, if one is open, e.g. in `make()`).
+            Unlike `EventInterpolation.batch()`, which streams rows and skips
+            duplicates, the whole frame is loaded atomically: interpolation
+            types are validated with one query before anything is written,
+            and a missing referenced Event (enforced by the database's foreign
+            key) or a duplicate row raises and rolls back the whole frame.
+            :param df: DataFrame with one column per attribute
+            :param chunk_size: maximum number of rows per INSERT statement
+        """
+        missing = (set(df['interpolation_type'])
+                   - set(InterpolationType.fetch('interpolation_type')))
+        if missing:
+            raise dj.errors.IntegrityError(
+                f'Unknown interpolation_type(s): {sorted(missing)}')
+
+        with _transaction():
+            for i in range(0, len(df), chunk_size):
+                cls.insert(df.iloc[i:i + chunk_size])
+
+    @staticmethod
+    def _needs_correction(indices, allowed_diffs=None):
+        """
+        Boolean mask of the frames whose OCR frame index needs correction:
+        missing readings (zero/NaN) and frames whose diff to the previous frame
+        is not in `allowed_diffs`. The camera and OptiTrack rates are not
+        integer multiples, so clean data mixes two adjacent steps (e.g. 4,5,5);
+        by default these are the most frequent diff between valid frames and
+        its more frequent neighbour (+/-1) if that makes up at least a quarter
+        as many diffs, so isolated misreads do not shift the steps. Clean
+        recordings yield an all-False mask, so per-frame correction only needs
+        to visit `np.flatnonzero(mask)`.
+        """
+        indices = np.asarray(indices, dtype=np.float64)
+        valid = indices > 0
+        mask = ~valid
+        diffs = np.diff(indices)
+        valid_pairs = valid[1:] & valid[:-1]
+        if allowed_diffs is None:
+            if not valid_pairs.any():
+                return mask
+            steps, counts = np.unique(diffs[valid_pairs], return_counts=True)
+            step_counts = dict(zip(steps, counts))
+            step = steps[np.argmax(counts)]
+            neighbour = max((step - 1, step + 1),
+                            key=lambda diff: step_counts.get(diff, 0))
+            allowed_diffs = [step]
+            if 4 * step_counts.get(neighbour, 0) >= step_counts[step]:
+                allowed_diffs.append(neighbour)
+        mask[1:] |= valid_pairs & ~np.isin(diffs, allowed_diffs)
+        return mask
+
+    @staticmethod
+    def _correct_pattern_446(indices):
+        """
+        Correct every run of frame diffs 4,4,6 to 4,5,5 (PATTERN_446) by
+        incrementing the frame index between the second and third diff.
+        :return: (corrected indices, positions of the corrected frames)
+        """
+        indices = np.asarray(indices)
+        diffs = np.nan_to_num(np.diff(indices.astype(np.float64)))
+        diffs = np.clip(diffs, 0, 255).astype(np.uint8)
+        if diffs.size < 3:
+            return indices.copy(), np.empty(0, dtype=np.intp)
+        windows = np.lib.stride_tricks.sliding_window_view(diffs, 3)
+        matches = np.flatnonzero(
+            np.all(windows == np.array([4, 4, 6], dtype=np.uint8), axis=1))
+        frames = matches + 2
+        corrected = indices.copy()
+        corrected[frames] += 1
+        return corrected, frames
+
+    @staticmethod
+    def _interpolate_missing(indices, n_edge_frames=5):
+        """
+        Fill missing (zero/NaN) frame indices in one vectorized pass: gaps
+        between valid frames by linear interpolation (INTERPOLATED), leading
+        and trailing gaps by extrapolating a linear fit of the first/last
+        `n_edge_frames` valid frames (EXTRAPOLATED_LEADING/_TRAILING). Leading
+        frames that would extrapolate to before frame 1 are set to 0
+        (LEADING_ZERO).
+        :return: (corrected indices as int64, interpolation_type per frame
+                  with '' for unchanged frames)
+        """
+        values = np.asarray(indices, dtype=np.float64)
+        interpolation_types = np.full(values.shape, '', dtype='U32')
+        good = np.flatnonzero(values > 0)
+        bad = np.flatnonzero(~(values > 0))
+        if bad.size == 0:
+            return values.astype(np.int64), interpolation_types
+        if good.size < 2:
+            raise ValueError('At least two valid frames are required'
+                             ' to interpolate missing frame indices')
+
+        filled = values.copy()
+        filled[bad] = np.interp(bad, good, values[good])
+        interpolation_types[bad] = 'INTERPOLATED'
+
+        leading = bad[bad < good[0]]
+        if leading.size:
+            edge = good[:n_edge_frames]
+            slope, intercept = np.polyfit(edge, values[edge], 1)
+            filled[leading] = np.rint(slope * leading + intercept)
+            interpolation_types[leading] = 'EXTRAPOLATED_LEADING'
+            before_start = leading[filled[leading] < 1]
+            filled[before_start] = 0
+            interpolation_types[before_start] = 'LEADING_ZERO'
+
+        trailing = bad[bad > good[-1]]
+        if trailing.size:
+            edge = good[-n_edge_frames:]
+            slope, intercept = np.polyfit(edge, values[edge], 1)
+            filled[trailing] = slope * trailing + intercept
+            interpolation_types[trailing] = 'EXTRAPOLATED_TRAILING'
+
+        return np.rint(filled).astype(np.int64), interpolation_types
+
+    @classmethod
+    def correct_frame_indices(cls, indices):
+        """
+        correct_frame_indices(indices) -> (np.ndarray, list)
+            Correct raw OCR frame indices (e.g. CameraTimestamps
+            raw_ocr_frame_indices): fill missing frames by interpolation/
+            extrapolation, then correct 4,4,6 diff runs to 4,5,5. Recordings
+            that pass the vectorized precheck are returned unchanged.
+            :param indices: raw frame indices, zero/NaN for missing readings
+            :return: (corrected frame indices as int64,
+                      list of EventInterpolation rows without the Event key,
+                      one per corrected frame)
+
+            corrected, rows = EventInterpolation.correct_frame_indices(raw)
+            EventInterpolation.insert({**event_key, **row} for row in rows)
+        """
+        original = np.nan_to_num(np.asarray(indices, dtype=np.float64))
+        if not cls._needs_correction(original).any():
+            return original.astype(np.int64), []
+
+        corrected, interpolation_types = cls._interpolate_missing(original)
+        corrected, frames = cls._correct_pattern_446(corrected)
+        interpolation_types[frames] = 'PATTERN_446'
+
+        original = original.astype(np.int64)
+        rows = []
+        for frame in np.flatnonzero(interpolation_types):
+            rows.append({
+                'frame_idx': int(frame),
+                'interpolation_type': str(interpolation_types[frame]),
+                'original_value': int(original[frame]),
+                'corrected_value': int(corrected[frame]),
+                'diff_before': (int(original[frame] - original[frame - 1])
+                                if frame else None),
+                'diff_after': (int(corrected[frame] - corrected[frame - 1])
+                               if frame else None)})
+        return corrected, rows
+
 
 @schema
 class CameraTimestamps(dj.Manual):
@@ -235,14 +536,18 @@ class CameraTimestamps(dj.Manual):
     This table provides a final sanity check and fallback mechanism by 
     preserving the original, uncorrected data from both independent 
     timestamp sources. Each array entry corresponds to one eye camera frame.
+
+    The arrays are kept in the external store `timestamps_store` (see
+    `activate`) so the table rows stay small; DataJoint compresses them when
+    serializing.
     """
     definition = """
     -> BehaviorRecording
     -> EventType                                    # e.g., 'mini2p1_eye_left_frames' or 'mini2p1_eye_right_frames'
     ---
-    raw_ocr_frame_indices       : longblob          # Raw OCR-extracted OptiTrack frame numbers (no correction)
-    csv_timestamps              : longblob          # Bonsai-RX timestamps from CSV (seconds, float64)
-    csv_timestamps_iso          : longblob          # Original ISO 8601 timestamp strings from CSV
+    raw_ocr_frame_indices       : blob@timestamps_store  # Raw OCR-extracted OptiTrack frame numbers (no correction)
+    csv_timestamps              : blob@timestamps_store  # Bonsai-RX timestamps from CSV (seconds, float64)
+    csv_timestamps_iso          : blob@timestamps_store  # Original ISO 8601 timestamp strings from CSV (uint8, one row per string; see decode_iso)
     csv_start_datetime          : datetime(6)       # First CSV timestamp as datetime (for reference)
     n_frames                    : int unsigned      # Total number of eye camera frames
     n_valid_ocr                 : int unsigned      # Number of frames with valid OCR readings
@@ -252,3 +557,308 @@ class CameraTimestamps(dj.Manual):
     notes=''                    : varchar(1024)     # Processing notes or warnings
     """
 
+    _blob_dtypes = {'raw_ocr_frame_indices': np.uint32,
+                    'csv_timestamps': np.float64}
+
+    def insert(self, rows, **kwargs):
+        """
+        Pack the timestamp arrays to compact dtypes before inserting, and fill
+        in csv_timestamps, csv_start_datetime (parsed from csv_timestamps_iso)
+        and the summary attributes (n_frames, n_valid_ocr, ...) not provided
+        """
+        if isinstance(rows, (list, tuple, types.GeneratorType)):
+            rows = [self._coerce_row(row) for row in rows]
+        return super().insert(rows, **kwargs)
+
+    @classmethod
+    def _coerce_row(cls, row):
+        if not isinstance(row, dict):
+            return row
+        row = dict(row)
+        if (row.get('csv_timestamps_iso') is not None
+                and (row.get('csv_timestamps') is None
+                     or row.get('csv_start_datetime') is None)):
+            csv_timestamps, csv_start_datetime = cls._iso_to_seconds(
+                row['csv_timestamps_iso'])
+            if row.get('csv_timestamps') is None:
+                row['csv_timestamps'] = csv_timestamps
+            if row.get('csv_start_datetime') is None:
+                row['csv_start_datetime'] = csv_start_datetime
+        for attr, dtype in cls._blob_dtypes.items():
+            if row.get(attr) is not None:
+                row[attr] = cls._pack(row[attr], dtype)
+        if row.get('csv_timestamps_iso') is not None:
+            row['csv_timestamps_iso'] = cls._encode_iso(row['csv_timestamps_iso'])
+        if (row.get('raw_ocr_frame_indices') is not None
+                and row.get('csv_timestamps') is not None):
+            row = {**cls._summarize(row['raw_ocr_frame_indices'],
+                                    row['csv_timestamps']), **row}
+        return row
+
+    @staticmethod
+    def _encode_iso(csv_timestamps_iso):
+        """
+        Encode ISO 8601 timestamps as a 2-D uint8 array with one zero-padded
+        ASCII row per timestamp: a single contiguous buffer that DataJoint's
+        blob format can store (it has no type for fixed-width bytes arrays)
+        """
+        iso = np.asarray(csv_timestamps_iso)
+        if iso.dtype == np.uint8 and iso.ndim == 2:
+            return iso
+        iso = np.ascontiguousarray(iso, dtype=np.bytes_)
+        return iso.view(np.uint8).reshape(iso.size, iso.dtype.itemsize)
+
+    @staticmethod
+    def decode_iso(csv_timestamps_iso):
+        """
+        decode_iso(csv_timestamps_iso) -> np.ndarray
+            Decode a fetched `csv_timestamps_iso` (2-D uint8, one row per
+            timestamp) to an array of ISO 8601 strings
+        """
+        iso = np.asarray(csv_timestamps_iso)
+        if iso.dtype == np.uint8 and iso.ndim == 2:
+            iso = np.ascontiguousarray(iso).view(f'S{iso.shape[1]}').ravel()
+        if iso.dtype.kind == 'S':
+            iso = np.char.decode(iso, 'ascii')
+        return iso
+
+    @classmethod
+    def _iso_to_seconds(cls, csv_timestamps_iso):
+        """
+        Parse ISO 8601 timestamps (strings, bytes or encoded as by
+        `_encode_iso`) in bulk with numpy.
+        Timestamps carrying a UTC offset are converted to UTC.
+        :return: (float64 seconds relative to the first timestamp,
+                  first timestamp as datetime)
+        """
+        iso = cls.decode_iso(csv_timestamps_iso)
+        with warnings.catch_warnings():
+            # numpy warns when parsing timestamps with a UTC offset
+            warnings.simplefilter('ignore', UserWarning)
+            timestamps = iso.astype('datetime64[ns]')
+        seconds = (timestamps - timestamps[0]).astype(np.int64) * 1e-9
+        return seconds, timestamps[0].astype('datetime64[us]').item()
+
+    @staticmethod
+    def _summarize(raw_ocr_frame_indices, csv_timestamps):
+        """
+        Summary attributes of the two timestamp arrays. The CSV frame rate and
+        duration only need the first/last timestamps (mean interval is
+        duration / (n - 1)), so the arrays are traversed once for the OCR count.
+        """
+        raw_ocr_frame_indices = np.asarray(raw_ocr_frame_indices)
+        csv_timestamps = np.asarray(csv_timestamps, dtype=np.float64)
+        n_csv = csv_timestamps.size
+        duration = float(csv_timestamps[-1] - csv_timestamps[0]) if n_csv else 0.0
+        return {
+            'n_frames': raw_ocr_frame_indices.size,
+            'n_valid_ocr': int(np.count_nonzero(raw_ocr_frame_indices > 0)),
+            'n_csv_timestamps': n_csv,
+            'frame_rate_csv_hz': (n_csv - 1) / duration if duration > 0 else 0.0,
+            'csv_duration_sec': duration,
+        }
+
+    @staticmethod
+    def _pack(arr, dtype):
+        """
+        Return `arr` as a C-contiguous array of `dtype` when the cast is
+        lossless (e.g. int64 frame indices -> uint32), otherwise unchanged
+        (e.g. raw OCR readings containing NaN or negative values)
+        """
+        arr = np.asarray(arr)
+        with np.errstate(invalid='ignore', over='ignore'):
+            packed = np.ascontiguousarray(arr, dtype=dtype)
+        if packed.dtype != arr.dtype and not np.array_equal(packed, arr):
+            return arr
+        return packed
+
+
+# ---- HELPER ----
+
+
+@contextlib.contextmanager
+def _transaction():
+    """
+    Run the block in a transaction, joining the caller's if one is already
+    open (DataJoint does not support nested transactions, and `populate()`
+    runs each `make()` in one)
+    """
+    connection = dj.conn()
+    if connection.in_transaction:
+        yield connection
+    else:
+        with connection.transaction:
+            yield connection
+
+
+class BatchInserter:
+    """
+    BatchInserter(table, chunk_size=10_000)
+        Context manager that buffers rows and inserts them into `table` as
+        multi-row INSERTs of up to `chunk_size` rows, all within a single
+        transaction (the caller's, if one is open, e.g. in `make()` during
+        `populate()`). Remaining rows are flushed on exit; the transaction is
+        rolled back if the block raises.
+
+        with Event.batch() as inserter:
+            for row in rows:
+                inserter.add(row)
+    """
+
+    def __init__(self, table, chunk_size=10_000):
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        self.table = table
+        self.chunk_size = chunk_size
+        self._buffer = []
+        self._transaction = None
+
+    def add(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        if self._buffer:
+            self.table.insert(self._buffer, skip_duplicates=True,
+                              allow_direct_insert=True)
+            self._buffer = []
+
+    def __enter__(self):
+        self._transaction = _transaction()
+        self._transaction.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        transaction, self._transaction = self._transaction, None
+        if exc_type is None:
+            try:
+                self.flush()
+            except Exception as e:
+                transaction.__exit__(type(e), e, e.__traceback__)
+                raise
+        else:
+            self._buffer = []
+        return transaction.__exit__(exc_type, exc_value, traceback)
+
+
+# event times are part of the Event primary key and stored as double, which
+# compares bit-exactly: `Event.insert` rounds them to 10 us so the same event
+# re-ingested with float noise maps to one key. Rows referencing an Event
+# (e.g. EventInterpolation) must use the stored, rounded time.
+EVENT_TIME_DECIMALS = 5
+_EVENT_TIME_ATTRIBUTES = ('event_start_time', 'event_end_time')
+
+
+def _round_event_times(row, attribute_names=None):
+    """Round the event times of a dict row, or of a positional row given the
+    table's `attribute_names`"""
+    if isinstance(row, dict):
+        row = dict(row)
+        for attr in _EVENT_TIME_ATTRIBUTES:
+            if row.get(attr) is not None:
+                row[attr] = round(float(row[attr]), EVENT_TIME_DECIMALS)
+    elif isinstance(row, (list, tuple)) and attribute_names is not None:
+        row = list(row)
+        for attr in _EVENT_TIME_ATTRIBUTES:
+            position = attribute_names.index(attr)
+            if position < len(row) and row[position] is not None:
+                row[position] = round(float(row[position]), EVENT_TIME_DECIMALS)
+    return row
+
+
+def bulk_insert_events(recording_key, rows, chunk_size=10_000):
+    """
+    bulk_insert_events(recording_key, rows, chunk_size=10_000)
+        Insert Event rows for one BehaviorRecording in chunks of `chunk_size`
+        within a single transaction
+        :param recording_key: a dictionary of one BehaviorRecording `key`
+        :param rows: iterable of dictionaries with (at least) `event_type`
+                     and `event_start_time`
+        :param chunk_size: maximum number of rows per INSERT statement
+    """
+    with Event.batch(chunk_size=chunk_size) as inserter:
+        inserter.extend({**row, **recording_key} for row in rows)
+
+
+# rows of the (small, rarely changing) lookup tables, by table name
+_lookup_cache = {}
+
+
+def refresh_lookup_cache():
+    """
+    refresh_lookup_cache()
+        Clear the in-process cache of EventType/InterpolationType rows used by
+        `get_event_type` and `get_interpolation_type`
+    """
+    _lookup_cache.clear()
+
+
+def get_event_type(event_type):
+    """
+    get_event_type(event_type) -> dict
+        :param event_type: name of one EventType
+        :return: the EventType row, read from the in-process cache
+    """
+    return _get_lookup_row(EventType, event_type)
+
+
+def get_interpolation_type(interpolation_type):
+    """
+    get_interpolation_type(interpolation_type) -> dict
+        :param interpolation_type: name of one InterpolationType
+        :return: the InterpolationType row, read from the in-process cache
+    """
+    return _get_lookup_row(InterpolationType, interpolation_type)
+
+
+def _get_lookup_row(table, name):
+    rows = _lookup_cache.get(table.__name__)
+    if rows is None or name not in rows:
+        # (re)load on first use and on a miss, e.g. a newly inserted EventType
+        (primary_key,) = table.primary_key
+        rows = _lookup_cache[table.__name__] = {
+            row[primary_key]: row for row in table.fetch(as_dict=True)}
+    return dict(rows[name])
+
+
+def enable_query_cache(path, query_cache='element_event'):
+    """
+    enable_query_cache(path, query_cache='element_event')
+        Cache the results of SELECT queries of this connection on disk so that
+        repeated identical fetches (e.g. re-running analysis notebooks) skip
+        the database. Call once per session; while enabled the connection is
+        read-only. Disable with `dj.conn().set_query_cache()`, clear with
+        `dj.conn().purge_query_cache()`.
+        :param path: directory holding the cached results
+        :param query_cache: name of the cache, results are only reused for the
+                            same name
+    """
+    path = pathlib.Path(path).resolve()
+    path.mkdir(parents=True, exist_ok=True)
+    dj.config['query_cache'] = str(path)
+    dj.conn().set_query_cache(query_cache=query_cache)
+
+
+def warm_cache(restriction=None):
+    """
+    warm_cache(restriction=None)
+        Pre-fetch the commonly used projections of EventType, Event and the
+        scalar attributes of CameraTimestamps into the query cache (see
+        `enable_query_cache`). Only identical queries are served from cache.
+        :param restriction: restriction on Event and CameraTimestamps,
+                            e.g. a BehaviorRecording key
+    """
+    events, camera_timestamps = Event(), CameraTimestamps()
+    if restriction is not None:
+        events &= restriction
+        camera_timestamps &= restriction
+    EventType.fetch()
+    events.proj('event_end_time').fetch()
+    camera_timestamps.proj(
+        'csv_start_datetime', 'n_frames', 'n_valid_ocr', 'n_csv_timestamps',
+        'frame_rate_csv_hz', 'csv_duration_sec', 'notes').fetch()
@@ -1,7 +1,8 @@
 """Events are linked to Trials"""
 
 import datajoint as dj
-import inspect
+import sys
+import types
 import importlib
 from . import event
 
@@ -31,9 +32,11 @@ def activate(trial_schema_name, event_schema_name, *, create_schema=True,
                        identifying a recording session.
     """
     if isinstance(linking_module, str):
-        linking_module = importlib.import_module(linking_module)
-    assert inspect.ismodule(linking_module), "The argument 'dependency' must"\
-                                             + " be a module or module name"
+        linking_module = (sys.modules.get(linking_module)
+                          or importlib.import_module(linking_module))
+    if not isinstance(linking_module, types.ModuleType):
+        raise TypeError("The argument 'linking_module' must be a module"
+                        " or module name")
 
     global _linking_module
     _linking_module = linking_module
@@ -0,0 +1,280 @@
+import contextlib
+import datetime
+import types
+
+import numpy as np
+import pytest
+from datajoint import blob
+
+from element_event import event
+from element_event.event import CameraTimestamps, EventInterpolation
+
+
+# ---- EventInterpolation._needs_correction ----
+
+
+def test_needs_correction_clean_constant_step():
+    indices = np.arange(5, 85, 5)
+    assert not EventInterpolation._needs_correction(indices).any()
+
+
+def test_needs_correction_clean_mixed_steps():
+    # 4,5,5 cadence: camera and OptiTrack rates are not integer multiples
+    indices = np.cumsum([5] + [4, 5, 5] * 5)
+    assert indices.size == 16
+    assert not EventInterpolation._needs_correction(indices).any()
+
+
+def test_needs_correction_flags_missing_and_bad_steps():
+    indices = np.array([0, 5, 10, 15, 20, 25, 30, 35, 39, 45, 50, 0],
+                       dtype=np.uint32)
+    mask = EventInterpolation._needs_correction(indices)
+    np.testing.assert_array_equal(
+        mask, [True] + [False] * 7 + [True, True, False, True])
+
+
+def test_needs_correction_nan_is_missing():
+    mask = EventInterpolation._needs_correction([np.nan, 5, 10, 15])
+    np.testing.assert_array_equal(mask, [True, False, False, False])
+
+
+def test_needs_correction_allowed_diffs():
+    indices = np.array([5, 10, 16, 21])
+    mask = EventInterpolation._needs_correction(indices, allowed_diffs=[5])
+    np.testing.assert_array_equal(mask, [False, False, True, False])
+
+
+def test_needs_correction_single_outlier():
+    mask = EventInterpolation._needs_correction([10, 15, 20, 25, 30, 1000, 1005])
+    np.testing.assert_array_equal(
+        mask, [False, False, False, False, False, True, False])
+
+
+def test_needs_correction_no_valid_frames():
+    mask = EventInterpolation._needs_correction([0, 0, 0])
+    np.testing.assert_array_equal(mask, [True, True, True])
+
+
+# ---- EventInterpolation._correct_pattern_446 ----
+
+
+def test_correct_pattern_446_clean():
+    indices = np.cumsum([5] + [4, 5, 5] * 3)
+    corrected, frames = EventInterpolation._correct_pattern_446(indices)
+    np.testing.assert_array_equal(corrected, indices)
+    assert frames.size == 0
+
+
+def test_correct_pattern_446_runs():
+    indices = np.array([0, 4, 8, 14, 19, 23, 27, 33], dtype=np.uint32)
+    corrected, frames = EventInterpolation._correct_pattern_446(indices)
+    np.testing.assert_array_equal(frames, [2, 6])
+    np.testing.assert_array_equal(corrected, [0, 4, 9, 14, 19, 23, 28, 33])
+    np.testing.assert_array_equal(np.diff(corrected.astype(int))[:3], [4, 5, 5])
+    assert corrected.dtype == indices.dtype
+
+
+def test_correct_pattern_446_short_input():
+    corrected, frames = EventInterpolation._correct_pattern_446([1, 5])
+    np.testing.assert_array_equal(corrected, [1, 5])
+    assert frames.size == 0
+
+
+# ---- EventInterpolation._interpolate_missing ----
+
+
+def test_interpolate_missing_clean():
+    corrected, interpolation_types = EventInterpolation._interpolate_missing(
+        [5, 10, 15])
+    np.testing.assert_array_equal(corrected, [5, 10, 15])
+    np.testing.assert_array_equal(interpolation_types, ['', '', ''])
+
+
+def test_interpolate_missing_gaps():
+    indices = np.array([0, 0, 10, 15, 0, 25, 30, 0], dtype=np.uint32)
+    corrected, interpolation_types = EventInterpolation._interpolate_missing(
+        indices)
+    np.testing.assert_array_equal(corrected, [0, 5, 10, 15, 20, 25, 30, 35])
+    np.testing.assert_array_equal(
+        interpolation_types,
+        ['LEADING_ZERO', 'EXTRAPOLATED_LEADING', '', '', 'INTERPOLATED', '',
+         '', 'EXTRAPOLATED_TRAILING'])
+
+
+def test_interpolate_missing_never_negative():
+    corrected, interpolation_types = EventInterpolation._interpolate_missing(
+        [0, 0, 0, 1, 5, 9])
+    np.testing.assert_array_equal(corrected, [0, 0, 0, 1, 5, 9])
+    np.testing.assert_array_equal(
+        interpolation_types,
+        ['LEADING_ZERO', 'LEADING_ZERO', 'LEADING_ZERO', '', '', ''])
+
+
+def test_interpolate_missing_too_few_valid_frames():
+    with pytest.raises(ValueError):
+        EventInterpolation._interpolate_missing([0, 5, 0])
+
+
+# ---- EventInterpolation.correct_frame_indices ----
+
+
+def test_correct_frame_indices_clean():
+    indices = np.cumsum([5] + [4, 5, 5] * 5)
+    corrected, rows = EventInterpolation.correct_frame_indices(indices)
+    np.testing.assert_array_equal(corrected, indices)
+    assert rows == []
+
+
+def test_correct_frame_indices():
+    indices = [0, 4, 9, 14, 0, 24, 28, 32, 38]
+    corrected, rows = EventInterpolation.correct_frame_indices(indices)
+    np.testing.assert_array_equal(corrected, [0, 4, 9, 14, 19, 24, 28, 33, 38])
+    assert [(row['frame_idx'], row['interpolation_type']) for row in rows] == [
+        (0, 'LEADING_ZERO'), (4, 'INTERPOLATED'), (7, 'PATTERN_446')]
+    assert rows[1] == {'frame_idx': 4, 'interpolation_type': 'INTERPOLATED',
+                       'original_value': 0, 'corrected_value': 19,
+                       'diff_before': -14, 'diff_after': 5}
+    assert rows[0]['diff_before'] is None
+
+
+# ---- CameraTimestamps._pack ----
+
+
+def test_pack_lossless_cast():
+    packed = CameraTimestamps._pack([0, 5, 10], np.uint32)
+    assert packed.dtype == np.uint32
+    assert packed.flags['C_CONTIGUOUS']
+    np.testing.assert_array_equal(packed, [0, 5, 10])
+
+
+def test_pack_keeps_unrepresentable_values():
+    with_nan = CameraTimestamps._pack([np.nan, 5.0], np.uint32)
+    assert with_nan.dtype == np.float64
+    negative = CameraTimestamps._pack(np.array([-1, 5]), np.uint32)
+    np.testing.assert_array_equal(negative, [-1, 5])
+
+
+# ---- CameraTimestamps._summarize ----
+
+
+def test_summarize():
+    summary = CameraTimestamps._summarize(
+        np.array([0, 5, 10, 0], dtype=np.uint32), np.arange(0, 1, 0.25))
+    assert summary == {'n_frames': 4, 'n_valid_ocr': 2, 'n_csv_timestamps': 4,
+                       'frame_rate_csv_hz': 4.0, 'csv_duration_sec': 0.75}
+
+
+def test_summarize_empty():
+    summary = CameraTimestamps._summarize([], [])
+    assert summary['n_frames'] == summary['n_csv_timestamps'] == 0
+    assert summary['frame_rate_csv_hz'] == summary['csv_duration_sec'] == 0.0
+
+
+# ---- CameraTimestamps._iso_to_seconds ----
+
+
+def test_iso_to_seconds():
+    seconds, start = CameraTimestamps._iso_to_seconds(
+        ['2023-05-04T12:34:56.123456', '2023-05-04T12:34:57.623456'])
+    np.testing.assert_allclose(seconds, [0.0, 1.5])
+    assert start == datetime.datetime(2023, 5, 4, 12, 34, 56, 123456)
+
+
+def test_iso_to_seconds_bytes_with_utc_offset():
+    iso = np.array(['2023-05-04T12:34:56.1234567+02:00',
+                    '2023-05-04T12:34:56.1567567+02:00'], dtype=np.bytes_)
+    seconds, start = CameraTimestamps._iso_to_seconds(iso)
+    np.testing.assert_allclose(seconds, [0.0, 0.0333])
+    assert start == datetime.datetime(2023, 5, 4, 10, 34, 56, 123456)
+
+
+def test_coerce_row_fills_derived_attributes():
+    row = CameraTimestamps._coerce_row({
+        'raw_ocr_frame_indices': [0, 5, 10],
+        'csv_timestamps_iso': ['2023-05-04T12:34:56', '2023-05-04T12:34:56.5',
+                               '2023-05-04T12:34:57']})
+    np.testing.assert_allclose(row['csv_timestamps'], [0.0, 0.5, 1.0])
+    assert row['csv_start_datetime'] == datetime.datetime(2023, 5, 4, 12, 34, 56)
+    assert row['n_valid_ocr'] == 2
+    assert row['frame_rate_csv_hz'] == 2.0
+
+
+# ---- Event times ----
+
+
+def test_round_event_times():
+    row = event._round_event_times(
+        {'event_start_time': 1.000001 + 1e-12, 'event_end_time': None})
+    assert row == {'event_start_time': 1.0, 'event_end_time': None}
+    row = event._round_event_times(
+        ('s1', 'reward', 1.0000099999, 2.123456789),
+        ['session', 'event_type', 'event_start_time', 'event_end_time'])
+    assert row == ['s1', 'reward', 1.00001, 2.12346]
+
+
+# ---- BatchInserter ----
+
+
+class _Connection:
+    def __init__(self, in_transaction):
+        self.in_transaction = in_transaction
+        self.transactions = 0
+
+    @property
+    @contextlib.contextmanager
+    def transaction(self):
+        self.transactions += 1
+        yield self
+
+
+class _Table:
+    def __init__(self):
+        self.inserted = []
+
+    def insert(self, rows, **kwargs):
+        self.inserted.append(list(rows))
+
+
+@pytest.mark.parametrize('in_transaction, transactions', [(False, 1), (True, 0)])
+def test_batch_inserter_transaction(monkeypatch, in_transaction, transactions):
+    connection = _Connection(in_transaction)
+    monkeypatch.setattr(event.dj, 'conn', lambda: connection)
+    table = _Table()
+
+    with event.BatchInserter(table, chunk_size=2) as inserter:
+        inserter.extend([{'frame_idx': i} for i in range(3)])
+
+    assert connection.transactions == transactions
+    assert [len(chunk) for chunk in table.inserted] == [2, 1]
+
+
+# ---- cached linking module functions ----
+
+
+def test_experiment_root_data_dir_is_copied(monkeypatch):
+    linking_module = types.ModuleType('linking_module')
+    linking_module.get_experiment_root_data_dir = lambda: ['/data']
+    monkeypatch.setattr(event, '_default_linking_module', linking_module)
+    event._get_experiment_root_data_dir.cache_clear()
+
+    event.get_experiment_root_data_dir().append('/other')
+    assert event.get_experiment_root_data_dir() == ['/data']
+
+
+def test_lookup_rows_are_copied(monkeypatch):
+    monkeypatch.setitem(event._lookup_cache, 'EventType', {
+        'reward': {'event_type': 'reward', 'event_type_description': ''}})
+
+    event.get_event_type('reward')['event_type_description'] = 'changed'
+    assert event.get_event_type('reward')['event_type_description'] == ''
+
+
+def test_coerced_row_survives_blob_round_trip():
+    iso = ['2023-05-04T12:34:56.1234567+02:00', '2023-05-04T12:34:56.15']
+    row = CameraTimestamps._coerce_row({'raw_ocr_frame_indices': [0, 5],
+                                        'csv_timestamps_iso': iso})
+    for attr in ('raw_ocr_frame_indices', 'csv_timestamps', 'csv_timestamps_iso'):
+        np.testing.assert_array_equal(blob.unpack(blob.pack(row[attr])), row[attr])
+    fetched = blob.unpack(blob.pack(row['csv_timestamps_iso']))
+    np.testing.assert_array_equal(CameraTimestamps.decode_iso(fetched), iso)
+